@@ -25,6 +25,13 @@ import platform
 import posixpath
 import re
 import serial.serialutil
+import threading
+
+try:
+    import queue
+except ImportError:
+    # Python 2 calls the queue module Queue.
+    import Queue as queue
 
 import click
 import dotenv
@@ -40,6 +47,31 @@ import ampy.pyboard as pyboard
 
 
 _board = None
+_board_files = None
+
+
+# Code run on the board by the reset command.  on_next_reset sets the mode
+# the board boots into (returning an error message if that fails) and reset
+# then reboots it.
+_RESET_HELPER_SRC = """if 1:
+    def on_next_reset(x):
+        try:
+            import microcontroller
+        except:
+            if x == 'NORMAL': return ''
+            return 'Reset mode only supported on CircuitPython'
+        try:
+            microcontroller.on_next_reset(getattr(microcontroller.RunMode, x))
+        except ValueError as e:
+            return str(e)
+        return ''
+    def reset():
+        try:
+            import microcontroller
+        except:
+            import machine as microcontroller
+        microcontroller.reset()
+"""
 
 
 def windows_full_port_name(portname):
@@ -55,6 +87,43 @@ def windows_full_port_name(portname):
         return "\\\\.\\{0}".format(portname)
 
 
+def looks_like_text(data):
+    # Helper function to guess whether downloaded data is text rather than binary,
+    # only the start of the data is checked for NUL bytes to keep it cheap.
+    return b"\x00" not in data[:1024]
+
+
+def scan_directory(path):
+    # Helper function to list one local directory for put as (name, path,
+    # is_dir) tuples, skipping symlinked directories like os.walk does.
+    # os.scandir entries already know if they're a directory so nothing is
+    # stat'ed again, Pythons older than 3.5 fall back to one level of os.walk.
+    if hasattr(os, "scandir"):
+        for entry in os.scandir(path):
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    yield entry.name, entry.path, True
+            else:
+                yield entry.name, entry.path, False
+    else:
+        parent, child_dirs, child_files = next(os.walk(path))
+        for name in child_dirs:
+            child = os.path.join(parent, name)
+            if not os.path.islink(child):
+                yield name, child, True
+        for name in child_files:
+            yield name, os.path.join(parent, name), False
+
+
+def get_files():
+    # Helper function to create the board files instance on first use and
+    # share it between every command run against the board.
+    global _board_files
+    if _board_files is None:
+        _board_files = files.Files(_board)
+    return _board_files
+
+
 @click.group()
 @click.option(
     "--port",
@@ -91,12 +160,13 @@ def cli(port, baud, delay):
     ampy you can manipulate files on the board's internal filesystem and even run
     scripts.
     """
-    global _board
+    global _board, _board_files
     # On Windows fix the COM port path name for ports above 9 (see comment in
     # windows_full_port_name function).
     if platform.system() == "Windows":
         port = windows_full_port_name(port)
     _board = pyboard.Pyboard(port, baudrate=baud, rawdelay=delay)
+    _board_files = None
 
 
 @cli.command()
@@ -122,11 +192,17 @@ def get(remote_file, local_file):
       ampy --port /board/serial/port get main.py main.py
     """
     # Get the file contents.
-    board_files = files.Files(_board)
+    board_files = get_files()
     contents = board_files.get(remote_file)
     # Print the file out if no local file was provided, otherwise save it.
     if local_file is None:
-        print(contents.decode("utf-8"))
+        # Write the raw bytes so binary files come through untouched, only
+        # adding a trailing newline when showing text on a terminal.
+        stdout = click.get_binary_stream("stdout")
+        stdout.write(contents)
+        if stdout.isatty() and not contents.endswith(b"\n") and looks_like_text(contents):
+            stdout.write(b"\n")
+        stdout.flush()
     else:
         local_file.write(contents)
 
@@ -152,7 +228,7 @@ def mkdir(directory, exists_okay):
       ampy --port /board/serial/port mkdir /code
     """
     # Run the mkdir command.
-    board_files = files.Files(_board)
+    board_files = get_files()
     board_files.mkdir(directory, exists_okay=exists_okay)
 
 
@@ -189,16 +265,27 @@ def ls(directory, long_format, recursive):
 
       ampy --port /board/serial/port ls -l /foo/bar
     """
-    # List each file/directory on a separate line.
-    board_files = files.Files(_board)
+    # List each file/directory on a separate line, as soon as the board
+    # reports it.
+    board_files = get_files()
     for f in board_files.ls(directory, long_format=long_format, recursive=recursive):
-        print(f)
+        click.echo(f)
 
 
 @cli.command()
 @click.argument("local", type=click.Path(exists=True))
 @click.argument("remote", required=False)
-def put(local, remote):
+@click.option(
+    "--window",
+    "-w",
+    default=files.STREAM_WINDOW,
+    type=click.IntRange(min=1),
+    help="Number of chunks to send before waiting for the board to acknowledge them (default {0}).  Only raise this for boards with native USB, boards behind a USB to serial bridge can drop data.".format(
+        files.STREAM_WINDOW
+    ),
+    metavar="WINDOW",
+)
+def put(local, remote, window):
     """Put a file or folder and its contents on the board.
 
     Put will upload a local file or folder  to the board.  If the file already
@@ -228,39 +315,107 @@ def put(local, remote):
     /lib/adafruit_library on the board run:
 
       ampy --port /board/serial/port put adafruit_library /lib/adafruit_library
+
+    On boards with native USB (which has flow control) the upload can be sped
+    up by letting a few chunks be in flight at once with --window:
+
+      ampy --port /board/serial/port put --window 4 adafruit_library
     """
     # Use the local filename if no remote filename is provided.
     if remote is None:
         remote = os.path.basename(os.path.abspath(local))
+    board_files = get_files()
     # Check if path is a folder and do recursive copy of everything inside it.
     # Otherwise it's a file and should simply be copied over.
     if os.path.isdir(local):
-        # Directory copy, create the directory and walk all children to copy
-        # over the files.
-        board_files = files.Files(_board)
-        for parent, child_dirs, child_files in os.walk(local):
-            # Create board filesystem absolute path to parent directory.
-            remote_parent = posixpath.normpath(
-                posixpath.join(remote, os.path.relpath(parent, local))
-            )
+        # Directory copy, walk all children up front to build the list of
+        # remote directories to create and files to copy over.
+        directories = []
+        uploads = []
+        created = set(["/"])  # The root always exists.
+
+        def add_directory(remote_dir):
+            # Queue each remote directory to be created only once.
+            if remote_dir not in created:
+                created.add(remote_dir)
+                directories.append(remote_dir)
+
+        def walk(local_parent, remote_parent):
+            # Scan one local directory.  The remote prefix is built once per
+            # directory and each child just appends its name.
+            add_directory(remote_parent)
+            prefix = remote_parent
+            if not prefix.endswith("/"):
+                prefix += "/"
+            child_dirs = []
+            for name, path, is_dir in scan_directory(local_parent):
+                if is_dir:
+                    child_dirs.append((name, path))
+                else:
+                    uploads.append((prefix + name, path))
+            for name, path in child_dirs:
+                walk(path, prefix + name)
+
+        # Create any missing parents of the remote folder first (e.g. /lib
+        # when putting to /lib/adafruit_library), outermost first.
+        remote = posixpath.normpath(remote)
+        ancestors = []
+        parent = posixpath.dirname(remote)
+        while parent and parent not in created:
+            ancestors.append(parent)
+            parent = posixpath.dirname(parent)
+        for ancestor in reversed(ancestors):
+            add_directory(ancestor)
+        walk(local, remote)
+
+        def read_uploads(upload_queue):
+            # Read the local files on a separate thread so the next one is
+            # ready as soon as the board finishes with the previous one.  The
+            # queue is bounded so the whole tree is never held in memory, and
+            # files larger than a single chunk are passed along still open so
+            # they're streamed to the board instead of being read up front.
             try:
-                # Create remote parent directory.
-                board_files.mkdir(remote_parent)
-                # Loop through all the files and put them on the board too.
-                for filename in child_files:
-                    with open(os.path.join(parent, filename), "rb") as infile:
-                        remote_filename = posixpath.join(remote_parent, filename)
-                        board_files.put(remote_filename, infile.read())
-            except files.DirectoryExistsError:
-                # Ignore errors for directories that already exist.
-                pass
+                for remote_filename, local_filename in uploads:
+                    infile = open(local_filename, "rb")
+                    if os.fstat(infile.fileno()).st_size > files.STREAM_CHUNK_SIZE:
+                        upload_queue.put((remote_filename, infile))
+                    else:
+                        with infile:
+                            upload_queue.put((remote_filename, infile.read()))
+            except Exception as ex:
+                # Hand the error over to be raised on the main thread.
+                upload_queue.put(ex)
+
+        def queued_uploads(bar, upload_queue):
+            for _ in bar:
+                upload = upload_queue.get()
+                if isinstance(upload, Exception):
+                    raise upload
+                try:
+                    yield upload
+                finally:
+                    # Close any file which was streamed once it's been sent.
+                    if hasattr(upload[1], "close"):
+                        upload[1].close()
+
+        upload_queue = queue.Queue(maxsize=4)
+        reader = threading.Thread(target=read_uploads, args=(upload_queue,))
+        reader.daemon = True
+        reader.start()
+        # Send everything in a single raw REPL session instead of entering
+        # (and soft resetting) the board once per file.
+        with click.progressbar(uploads, label="Uploading files") as bar:
+            board_files.put_many(
+                queued_uploads(bar, upload_queue),
+                directories=directories,
+                window=window,
+            )
 
     else:
         # File copy, open the file and copy its contents to the board.
         # Put the file on the board.
         with open(local, "rb") as infile:
-            board_files = files.Files(_board)
-            board_files.put(remote, infile.read())
+            board_files.put_stream(remote, infile, window=window)
 
 
 @cli.command()
@@ -278,7 +433,7 @@ def rm(remote_file):
       ampy --port /board/serial/port rm main.py
     """
     # Delete the provided file/directory on the board.
-    board_files = files.Files(_board)
+    board_files = get_files()
     board_files.rm(remote_file)
 
 
@@ -300,7 +455,7 @@ def rmdir(remote_folder, missing_okay):
       ampy --port /board/serial/port rmdir adafruit_library
     """
     # Delete the provided file/directory on the board.
-    board_files = files.Files(_board)
+    board_files = get_files()
     board_files.rmdir(remote_folder, missing_okay=missing_okay)
 
 
@@ -332,7 +487,7 @@ def run(local_file, no_output):
       ampy --port /board/serial/port run --no-output test.py
     """
     # Run the provided file and print its output.
-    board_files = files.Files(_board)
+    board_files = get_files()
     try:
         output = board_files.run(local_file, not no_output)
         if output is not None:
@@ -374,34 +529,18 @@ def reset(mode):
 
       ampy --port /board/serial/port reset
     """
-    _board.enter_raw_repl()
     if mode == "SOFT":
-        _board.exit_raw_repl()
+        # A soft reset only needs a ctrl-D at the REPL (followed by ctrl-C to
+        # stop main.py), there's no need to go through the raw REPL for it.
+        _board.soft_reset()
         return
 
-    _board.exec_(
-        """if 1:
-        def on_next_reset(x):
-            try:
-                import microcontroller
-            except:
-                if x == 'NORMAL': return ''
-                return 'Reset mode only supported on CircuitPython'
-            try:
-                microcontroller.on_next_reset(getattr(microcontroller.RunMode, x))
-            except ValueError as e:
-                return str(e)
-            return ''
-        def reset():
-            try:
-                import microcontroller
-            except:
-                import machine as microcontroller
-            microcontroller.reset()
-    """
-    )
-    r = _board.eval("on_next_reset({})".format(repr(mode)))
-    print("here we are", repr(r))
+    _board.enter_raw_repl()
+    # Define the helpers and ask for the next reset mode in one go, the result
+    # is printed by the board so no separate eval round trip is needed.
+    r = _board.exec_(
+        _RESET_HELPER_SRC + "print(on_next_reset({0}))\n".format(repr(mode))
+    ).strip()
     if r:
         click.echo(r, err=True)
         return
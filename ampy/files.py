@@ -19,7 +19,7 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-import ast
+import io
 import textwrap
 
 from ampy.pyboard import PyboardError
@@ -29,6 +29,17 @@ BUFFER_SIZE = 32  # Amount of data to read or write to the serial port at a time
 # This is kept small because small chips and USB to serial
 # bridges usually have very small buffers.
 
+STREAM_CHUNK_SIZE = 4096  # Amount of data to send at a time when streaming a
+# file to the board.  The board acknowledges every chunk before the next one is
+# sent so it never has to buffer more than a single chunk.
+
+STREAM_ACK = b"\x06"  # Byte the board writes back after storing each chunk.
+
+STREAM_WINDOW = 1  # Number of chunks which may be in flight before waiting for
+# the board to acknowledge them.  Boards behind a USB to serial bridge have no
+# flow control and drop data which arrives while they write to flash, so only
+# raise this for boards with native USB (see the put command's --window).
+
 
 class DirectoryExistsError(Exception):
     pass
@@ -82,11 +93,12 @@ class Files(object):
 
     def ls(self, directory="/", long_format=True, recursive=False):
         """List the contents of the specified directory (or root if none is
-        specified).  Returns a list of strings with the names of files in the
-        specified directory.  If long_format is True then a list of 2-tuples
-        with the name and size (in bytes) of the item is returned.  Note that
-        it appears the size of directories is not supported by MicroPython and
-        will always return 0 (i.e. no recursive size computation).
+        specified).  Yields strings with the names of files in the specified
+        directory as the board prints them, so a long (recursive) listing can
+        be shown before it's complete.  If long_format is True then each name
+        is followed by the size (in bytes) of the item.  Note that it appears
+        the size of directories is not supported by MicroPython and will always
+        return 0 (i.e. no recursive size computation).
         """
 
         # Disabling for now, see https://github.com/adafruit/ampy/issues/55.
@@ -106,9 +118,7 @@ class Files(object):
 
         if recursive:
             command += """\
-                def listdir(directory):
-                    result = set()
-
+                def listdir(directory, show):
                     def _listdir(dir_or_file):
                         try:
                             # if its a directory, then it should provide some children.
@@ -116,12 +126,12 @@ class Files(object):
                         except OSError:                        
                             # probably a file. run stat() to confirm.
                             os.stat(dir_or_file)
-                            result.add(dir_or_file) 
+                            show(dir_or_file)
                         else:
-                            # probably a directory, add to result if empty.
+                            # probably a directory, show it if empty.
                             if children:
-                                # queue the children to be dealt with in next iteration.
-                                for child in children:
+                                # walk the children in order.
+                                for child in sorted(children):
                                     # create the full path.
                                     if dir_or_file == '/':
                                         next = dir_or_file + child
@@ -130,48 +140,58 @@ class Files(object):
                                     
                                     _listdir(next)
                             else:
-                                result.add(dir_or_file)                     
+                                show(dir_or_file)
 
-                    _listdir(directory)
-                    return sorted(result)\n"""
+                    _listdir(directory)\n"""
         else:
             command += """\
-                def listdir(directory):
-                    if directory == '/':                
-                        return sorted([directory + f for f in os.listdir(directory)])
-                    else:
-                        return sorted([directory + '/' + f for f in os.listdir(directory)])\n"""
+                def listdir(directory, show):
+                    for f in sorted(os.listdir(directory)):
+                        if directory == '/':                
+                            show(directory + f)
+                        else:
+                            show(directory + '/' + f)\n"""
 
-        # Execute os.listdir() command on the board.
+        # Execute os.listdir() command on the board, printing each item on its
+        # own line as soon as it's found.
         if long_format:
             command += """
-                r = []
-                for f in listdir('{0}'):
+                def show(f):
                     size = os.stat(f)[6]                    
-                    r.append('{{0}} - {{1}} bytes'.format(f, size))
-                print(r)
+                    print('{{0}} - {{1}} bytes'.format(f, size))
+                listdir('{0}', show)
             """.format(
                 directory
             )
         else:
             command += """
-                print(listdir('{0}'))
+                listdir('{0}', print)
             """.format(
                 directory
             )
         self._pyboard.enter_raw_repl()
-        try:
-            out = self._pyboard.exec_(textwrap.dedent(command))
-        except PyboardError as ex:
+        self._pyboard.exec_raw_no_follow(textwrap.dedent(command))
+        # Yield each line of output until the end of normal output is marked
+        # with an EOF.
+        while True:
+            line = self._pyboard.read_until(1, (b"\n", b"\x04"))
+            if line.endswith(b"\x04"):
+                break
+            if not line.endswith(b"\n"):
+                raise PyboardError("timeout waiting for first EOF reception")
+            yield line.decode("utf-8").rstrip("\r\n")
+        err = self._pyboard.read_until(1, b"\x04")
+        if not err.endswith(b"\x04"):
+            raise PyboardError("timeout waiting for second EOF reception")
+        err = err[:-1]
+        if err:
             # Check if this is an OSError #2, i.e. directory doesn't exist and
             # rethrow it as something more descriptive.
-            if ex.args[2].decode("utf-8").find("OSError: [Errno 2] ENOENT") != -1:
+            if err.decode("utf-8").find("OSError: [Errno 2] ENOENT") != -1:
                 raise RuntimeError("No such directory: {0}".format(directory))
             else:
-                raise ex
+                raise PyboardError("exception", b"", err)
         self._pyboard.exit_raw_repl()
-        # Parse the result list and return it.
-        return ast.literal_eval(out.decode("utf-8"))
 
     def mkdir(self, directory, exists_okay=False):
         """Create the specified directory.  Note this cannot create a recursive
@@ -219,6 +239,159 @@ class Files(object):
         self._pyboard.exec_("f.close()")
         self._pyboard.exit_raw_repl()
 
+    def put_many(self, pairs, directories=(), window=STREAM_WINDOW):
+        """Create or update many files in a single raw REPL session.  Pairs is
+        an iterable of 2-tuples with the remote filename and its data (either
+        a byte string or a binary file-like object to stream from), and
+        directories is an optional list of directories to create (in order)
+        before any file is written.  Directories which already exist are
+        ignored.  Entering the raw REPL soft resets the board, so uploading a
+        whole tree this way is much faster than calling put for each file.
+        Window is the number of chunks which may be sent before the board has
+        acknowledged the earlier ones, see STREAM_WINDOW.
+        """
+        uploads = (
+            (filename, io.BytesIO(data) if isinstance(data, bytes) else data)
+            for filename, data in pairs
+        )
+        self._pyboard.enter_raw_repl()
+        try:
+            self._put_stream(directories, uploads, STREAM_CHUNK_SIZE, window)
+        finally:
+            self._pyboard.exit_raw_repl()
+
+    def put_stream(
+        self, filename, fileobj, chunk_size=STREAM_CHUNK_SIZE, window=STREAM_WINDOW
+    ):
+        """Create or update the specified file with the contents of the provided
+        binary file-like object.  Unlike put the data is not sent as Python
+        source, instead a small receiver runs on the board and the raw bytes are
+        written to it chunk_size bytes at a time.  Window is the number of
+        chunks which may be sent before the board has acknowledged the earlier
+        ones, see STREAM_WINDOW.
+        """
+        self._pyboard.enter_raw_repl()
+        try:
+            self._put_stream((), [(filename, fileobj)], chunk_size, window)
+        finally:
+            self._pyboard.exit_raw_repl()
+
+    def _put_stream(self, directories, uploads, chunk_size, window):
+        # Start a receiver on the board which reads commands from stdin, one
+        # per line, until an empty line is sent.  'D <path>' creates a
+        # directory and 'F <path>' writes a file from chunks made of a length
+        # line followed by that many raw bytes, with a zero length chunk
+        # marking the end of the file.  Every chunk and command is
+        # acknowledged, and 'F' is also acknowledged once the file is open so
+        # no data arrives while the board is busy creating it.  Ctrl-C is
+        # disabled from then until the end of the file since the data can
+        # contain \x03 bytes (the board checks for it as bytes arrive, not as
+        # they're read), assumes the raw REPL has already been entered.
+        command = """
+            import sys
+            try:
+                import os
+            except ImportError:
+                import uos as os
+            try:
+                from micropython import kbd_intr
+            except ImportError:
+                kbd_intr = None
+            # Text stdin would decode the data, so fail rather than fall back.
+            stdin = sys.stdin.buffer
+            while True:
+                line = sys.stdin.readline().rstrip('\\r\\n')
+                if not line:
+                    break
+                if line[0] == 'D':
+                    try:
+                        os.mkdir(line[2:])
+                    except OSError as ex:
+                        if ex.args[0] != 17:
+                            raise
+                else:
+                    with open(line[2:], 'wb') as outfile:
+                        if kbd_intr:
+                            kbd_intr(-1)
+                        try:
+                            sys.stdout.write({0!r})
+                            while True:
+                                size = int(sys.stdin.readline())
+                                if not size:
+                                    break
+                                outfile.write(stdin.read(size))
+                                sys.stdout.write({0!r})
+                        finally:
+                            if kbd_intr:
+                                kbd_intr(3)
+                sys.stdout.write({0!r})
+        """.format(
+            STREAM_ACK.decode("utf-8")
+        )
+        self._pyboard.exec_raw_no_follow(textwrap.dedent(command))
+        in_file = False
+        try:
+            pending = 0
+            for directory in directories:
+                self._pyboard.serial.write("D {0}\n".format(directory).encode("utf-8"))
+                pending = self._wait_acks(pending + 1, window)
+            for filename, fileobj in uploads:
+                self._pyboard.serial.write("F {0}\n".format(filename).encode("utf-8"))
+                # Wait for the file to be opened before sending any of its data.
+                pending = self._wait_acks(pending + 1, 1)
+                in_file = True
+                while True:
+                    chunk = fileobj.read(chunk_size)
+                    header = "{0}\n".format(len(chunk)).encode("utf-8")
+                    self._pyboard.serial.write(header + chunk)
+                    if not chunk:
+                        in_file = False
+                    # The final empty chunk is acknowledged once the file is
+                    # closed, just like a directory command.
+                    pending = self._wait_acks(pending + 1, window)
+                    if not chunk:
+                        break
+            self._pyboard.serial.write(b"\n")
+            self._wait_acks(pending, 1)
+        except PyboardError:
+            # The receiver failed and the board is already back at the raw
+            # REPL prompt.
+            raise
+        except BaseException:
+            # Something failed on this side (reading a local file, Ctrl-C,
+            # ...) so stop the receiver rather than leave it waiting for data.
+            self._stop_receiver(in_file)
+            raise
+        out, err = self._pyboard.follow(10)
+        if err:
+            raise PyboardError("exception", out, err)
+
+    def _stop_receiver(self, in_file):
+        # End the file being sent (if any) and the receiver's command loop,
+        # also sending Ctrl-C in case it's waiting anywhere else, then wait
+        # for it to finish.  Errors here are ignored so the original one is
+        # what gets raised.
+        try:
+            if in_file:
+                self._pyboard.serial.write(b"0\n")
+            self._pyboard.serial.write(b"\n\x03")
+            self._pyboard.follow(10)
+        except (Exception, PyboardError):
+            pass
+
+    def _wait_acks(self, pending, window):
+        # Read acknowledgements until fewer than window are outstanding, also
+        # consuming any which have already arrived without blocking for them.
+        # Returns the number still outstanding.  If the receiver failed the
+        # board will instead print the traceback and return to the raw REPL
+        # prompt.
+        while pending >= window or (pending and self._pyboard.serial.inWaiting()):
+            data = self._pyboard.read_until(1, (STREAM_ACK, b"\x04>"))
+            if not data.endswith(STREAM_ACK):
+                raise PyboardError("exception", b"", data)
+            pending -= 1
+        return pending
+
     def rm(self, filename):
         """Remove the specified file or directory."""
         command = """
@@ -118,6 +118,41 @@ class TelnetToSerial:
         else:
             return n_waiting
 
+class BufferedSerial:
+    """Wrap a serial port so every read drains all the bytes the OS already has
+    waiting in one call.  Later small reads (read_until consumes one byte at a
+    time) are then served from memory instead of costing a syscall each.
+    """
+    def __init__(self, serial):
+        self.serial = serial
+        self.buf = bytearray()
+
+    def __getattr__(self, name):
+        # Anything not overridden here (write, close, timeout, ...) goes
+        # straight to the wrapped port.
+        return getattr(self.serial, name)
+
+    def read(self, size=1):
+        if len(self.buf) < size:
+            # Block for the missing bytes as a plain read would, but also pick
+            # up everything else which has already arrived.
+            want = max(size - len(self.buf), self.serial.inWaiting())
+            self.buf.extend(self.serial.read(want))
+        data = bytes(self.buf[:size])
+        del self.buf[:size]
+        return data
+
+    def inWaiting(self):
+        # Only ask the port when the buffer is empty, read_until calls this
+        # before every byte it reads.
+        if self.buf:
+            return len(self.buf)
+        return self.serial.inWaiting()
+
+    @property
+    def in_waiting(self):
+        return self.inWaiting()
+
 class Pyboard:
     def __init__(self, device, baudrate=115200, user='micro', password='python', wait=0, rawdelay=0):
         global _rawdelay
@@ -130,7 +165,7 @@ class Pyboard:
             delayed = False
             for attempt in range(wait + 1):
                 try:
-                    self.serial = serial.Serial(device, baudrate=baudrate, interCharTimeout=1)
+                    self.serial = BufferedSerial(serial.Serial(device, baudrate=baudrate, interCharTimeout=1))
                     break
                 except (OSError, IOError): # Py2 and Py3 have different errors
                     if wait == 0:
@@ -211,6 +246,33 @@ class Pyboard:
             print(data)
             raise PyboardError('could not enter raw repl')
 
+    def soft_reset(self):
+        # Brief delay before sending the reset if requested, like entering
+        # the raw REPL
+        if _rawdelay > 0:
+            time.sleep(_rawdelay)
+
+        self.serial.write(b'\r\x03\x03') # ctrl-C twice: interrupt any running program
+
+        # flush input (without relying on serial.flushInput())
+        n = self.serial.inWaiting()
+        while n > 0:
+            self.serial.read(n)
+            n = self.serial.inWaiting()
+
+        self.serial.write(b'\x04') # ctrl-D: soft reset
+        data = self.read_until(1, b'soft reboot\r\n')
+        if not data.endswith(b'soft reboot\r\n'):
+            print(data)
+            raise PyboardError('could not soft reset')
+        # Unlike a soft reboot from the raw REPL, one from the friendly REPL
+        # runs main.py, so interrupt it the same way as in enter_raw_repl to
+        # leave the board at the REPL.
+        time.sleep(0.5)
+        self.serial.write(b'\x03')
+        time.sleep(0.1)           # (slight delay before second interrupt
+        self.serial.write(b'\x03')
+
     def exit_raw_repl(self):
         self.serial.write(b'\r\x02') # ctrl-B: enter friendly REPL
 
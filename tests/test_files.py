@@ -19,6 +19,7 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import io
 import tempfile
 import sys
 import unittest
@@ -44,30 +45,43 @@ class TestFiles(unittest.TestCase):
 
     def test_ls_multiple_files(self):
         pyboard = mock.Mock()
-        pyboard.exec_ = mock.Mock(return_value=b"['boot.py', 'main.py', 'foo.txt']")
+        pyboard.read_until = mock.Mock(
+            side_effect=[b"/boot.py\r\n", b"/foo.txt\r\n", b"/main.py\r\n", b"\x04", b"\x04"]
+        )
         board_files = files.Files(pyboard)
-        result = board_files.ls()
-        self.assertListEqual(result, ["boot.py", "main.py", "foo.txt"])
+        result = list(board_files.ls())
+        self.assertListEqual(result, ["/boot.py", "/foo.txt", "/main.py"])
 
     def test_ls_no_files(self):
         pyboard = mock.Mock()
-        pyboard.exec_ = mock.Mock(return_value=b"[]")
+        pyboard.read_until = mock.Mock(side_effect=[b"\x04", b"\x04"])
         board_files = files.Files(pyboard)
-        result = board_files.ls()
+        result = list(board_files.ls())
         self.assertListEqual(result, [])
 
+    def test_ls_streams_results(self):
+        pyboard = mock.Mock()
+        pyboard.read_until = mock.Mock(
+            side_effect=[b"/foo/a.txt\r\n", b"/foo/b/c.txt\r\n", b"\x04", b"\x04"]
+        )
+        board_files = files.Files(pyboard)
+        result = board_files.ls("/foo", recursive=True)
+        # The first entry is available after reading a single line.
+        self.assertEqual(next(result), "/foo/a.txt")
+        self.assertEqual(pyboard.read_until.call_count, 1)
+        self.assertListEqual(list(result), ["/foo/b/c.txt"])
+
     def test_ls_bad_directory(self):
         pyboard = mock.Mock()
-        pyboard.exec_ = mock.Mock(
-            side_effect=PyboardError(
-                "exception",
-                b"",
-                b'Traceback (most recent call last):\r\n  File "<stdin>", line 3, in <module>\r\nOSError: [Errno 2] ENOENT\r\n',
-            )
+        pyboard.read_until = mock.Mock(
+            side_effect=[
+                b"\x04",
+                b'Traceback (most recent call last):\r\n  File "<stdin>", line 3, in <module>\r\nOSError: [Errno 2] ENOENT\r\n\x04',
+            ]
         )
         with self.raisesRegex(RuntimeError, "No such directory: /foo"):
             board_files = files.Files(pyboard)
-            result = board_files.ls("/foo")
+            result = list(board_files.ls("/foo"))
 
     def test_get_with_data(self):
         pyboard = mock.Mock()
@@ -95,6 +109,129 @@ class TestFiles(unittest.TestCase):
         board_files = files.Files(pyboard)
         board_files.put("foo.txt", "hello world")
 
+    def test_put_stream(self):
+        pyboard = mock.Mock()
+        pyboard.read_until = mock.Mock(return_value=files.STREAM_ACK)
+        pyboard.follow = mock.Mock(return_value=(b"", b""))
+        board_files = files.Files(pyboard)
+        board_files.put_stream("foo.txt", io.BytesIO(b"hello world"), chunk_size=8)
+        pyboard.serial.write.assert_has_calls(
+            [
+                mock.call(b"F foo.txt\n"),
+                mock.call(b"8\nhello wo"),
+                mock.call(b"3\nrld"),
+                mock.call(b"0\n"),
+                mock.call(b"\n"),
+            ]
+        )
+        self.assertEqual(pyboard.read_until.call_count, 4)
+
+    def test_put_stream_receiver_error(self):
+        pyboard = mock.Mock()
+        pyboard.read_until = mock.Mock(
+            return_value=b"\x04Traceback (most recent call last):\r\nOSError: [Errno 2] ENOENT\r\n\x04>"
+        )
+        board_files = files.Files(pyboard)
+        with self.assertRaises(PyboardError):
+            board_files.put_stream("/foo/bar.txt", io.BytesIO(b"hello world"))
+        pyboard.exit_raw_repl.assert_called_once_with()
+
+    def test_put_stream_local_error(self):
+        pyboard = mock.Mock()
+        pyboard.read_until = mock.Mock(return_value=files.STREAM_ACK)
+        pyboard.follow = mock.Mock(return_value=(b"", b""))
+        infile = mock.Mock()
+        infile.read = mock.Mock(side_effect=IOError("read failed"))
+        board_files = files.Files(pyboard)
+        with self.assertRaises(IOError):
+            board_files.put_stream("foo.txt", infile)
+        # The open file is ended and the receiver stopped before leaving the
+        # raw REPL.
+        pyboard.serial.write.assert_has_calls(
+            [mock.call(b"F foo.txt\n"), mock.call(b"0\n"), mock.call(b"\n\x03")]
+        )
+        pyboard.follow.assert_called_once_with(10)
+        pyboard.exit_raw_repl.assert_called_once_with()
+
+    def test_put_many_error_between_files(self):
+        pyboard = mock.Mock()
+        pyboard.read_until = mock.Mock(return_value=files.STREAM_ACK)
+        pyboard.follow = mock.Mock(return_value=(b"", b""))
+
+        def uploads():
+            yield "/foo.txt", b"hello"
+            raise IOError("read failed")
+
+        board_files = files.Files(pyboard)
+        with self.assertRaises(IOError):
+            board_files.put_many(uploads())
+        self.assertEqual(
+            pyboard.serial.write.call_args_list[-2:],
+            [mock.call(b"0\n"), mock.call(b"\n\x03")],
+        )
+        pyboard.follow.assert_called_once_with(10)
+
+    def test_put_many(self):
+        pyboard = mock.Mock()
+        pyboard.read_until = mock.Mock(return_value=files.STREAM_ACK)
+        pyboard.follow = mock.Mock(return_value=(b"", b""))
+        board_files = files.Files(pyboard)
+        board_files.put_many(
+            [("/foo/a.txt", b"hello"), ("/foo/b.txt", b"world")],
+            directories=["/foo"],
+        )
+        pyboard.enter_raw_repl.assert_called_once_with()
+        pyboard.exec_raw_no_follow.assert_called_once()
+        pyboard.exit_raw_repl.assert_called_once_with()
+        pyboard.serial.write.assert_has_calls(
+            [
+                mock.call(b"D /foo\n"),
+                mock.call(b"F /foo/a.txt\n"),
+                mock.call(b"5\nhello"),
+                mock.call(b"0\n"),
+                mock.call(b"F /foo/b.txt\n"),
+                mock.call(b"5\nworld"),
+                mock.call(b"0\n"),
+                mock.call(b"\n"),
+            ]
+        )
+
+    def test_put_many_file_object(self):
+        pyboard = mock.Mock()
+        pyboard.read_until = mock.Mock(return_value=files.STREAM_ACK)
+        pyboard.follow = mock.Mock(return_value=(b"", b""))
+        board_files = files.Files(pyboard)
+        board_files.put_many([("/foo.txt", io.BytesIO(b"hello"))])
+        pyboard.serial.write.assert_has_calls(
+            [mock.call(b"F /foo.txt\n"), mock.call(b"5\nhello"), mock.call(b"0\n")]
+        )
+
+    def test_put_many_window(self):
+        pyboard = mock.Mock()
+        pyboard.serial.inWaiting = mock.Mock(return_value=0)
+        pyboard.read_until = mock.Mock(return_value=files.STREAM_ACK)
+        pyboard.follow = mock.Mock(return_value=(b"", b""))
+        board_files = files.Files(pyboard)
+        board_files.put_many([("/foo.txt", b"hello")], window=3)
+        # Only the file being opened is waited for until the window fills up,
+        # then everything outstanding is collected at the end.
+        self.assertEqual(pyboard.read_until.call_count, 3)
+
+    def test_put_stream_window_collects_early_acks(self):
+        pyboard = mock.Mock()
+        # An ack is waiting before the window is full, so it's read straight
+        # away instead of later.
+        pyboard.serial.inWaiting = mock.Mock(side_effect=[1, 0, 0, 0])
+        pyboard.read_until = mock.Mock(return_value=files.STREAM_ACK)
+        pyboard.follow = mock.Mock(return_value=(b"", b""))
+        board_files = files.Files(pyboard)
+        board_files.put_stream(
+            "foo.txt", io.BytesIO(b"hello world"), chunk_size=4, window=4
+        )
+        # One for the open, one for each chunk and the end of the file.
+        self.assertEqual(pyboard.read_until.call_count, 5)
+        self.assertEqual(pyboard.serial.inWaiting.call_count, 4)
+
     def test_rm(self):
         pyboard = mock.Mock()
         pyboard.exec_ = mock.Mock(return_value=b"")
@@ -0,0 +1,127 @@
+# Adafruit MicroPython Tool - Pyboard Serial Tests
+# Copyright (c) 2016 Adafruit Industries
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import unittest
+
+# Try importing python 3 mock library, then fall back to python 2 (external module).
+try:
+    import unittest.mock as mock
+except ImportError:
+    import mock
+
+import ampy.pyboard as pyboard
+from ampy.pyboard import BufferedSerial, Pyboard
+
+
+def mock_port(waiting):
+    # Build a mock serial port which has the provided bytes waiting to be read.
+    # Like a port with a timeout, read returns what's there even if that's
+    # less than was asked for.
+    waiting = bytearray(waiting)
+
+    def read(size):
+        data = bytes(waiting[:size])
+        del waiting[:size]
+        return data
+
+    port = mock.Mock()
+    port.read = mock.Mock(side_effect=read)
+    port.inWaiting = mock.Mock(side_effect=lambda: len(waiting))
+    port.waiting = waiting
+    return port
+
+
+class TestBufferedSerial(unittest.TestCase):
+    def test_read_drains_port(self):
+        port = mock_port(b"hello world")
+        serial = BufferedSerial(port)
+        self.assertEqual(serial.read(1), b"h")
+        port.read.assert_called_once_with(11)
+        # The rest is served from the buffer without touching the port.
+        port.inWaiting.reset_mock()
+        self.assertEqual(serial.inWaiting(), 10)
+        self.assertEqual(serial.read(4), b"ello")
+        self.assertEqual(serial.in_waiting, 6)
+        port.read.assert_called_once_with(11)
+        port.inWaiting.assert_not_called()
+
+    def test_read_partial_buffer(self):
+        port = mock_port(b"abc")
+        serial = BufferedSerial(port)
+        self.assertEqual(serial.read(1), b"a")
+        port.waiting.extend(b"defgh")
+        # Two bytes are buffered, the rest (and everything else waiting) comes
+        # from the port.
+        self.assertEqual(serial.read(4), b"bcde")
+        port.read.assert_called_with(5)
+        self.assertEqual(serial.inWaiting(), 3)
+        self.assertEqual(serial.read(3), b"fgh")
+        self.assertEqual(serial.inWaiting(), 0)
+
+    def test_read_timeout(self):
+        port = mock_port(b"ab")
+        port.inWaiting = mock.Mock(return_value=0)
+        serial = BufferedSerial(port)
+        # The port times out with fewer bytes than asked for, which are
+        # returned as is.
+        self.assertEqual(serial.read(5), b"ab")
+        port.read.assert_called_once_with(5)
+        self.assertEqual(serial.read(1), b"")
+
+    def test_write_passes_through(self):
+        port = mock.Mock()
+        serial = BufferedSerial(port)
+        serial.write(b"hello")
+        port.write.assert_called_once_with(b"hello")
+
+
+class TestPyboard(unittest.TestCase):
+    @mock.patch("ampy.pyboard.time.sleep")
+    @mock.patch("ampy.pyboard._rawdelay", 2)
+    def test_soft_reset(self, sleep):
+        board = Pyboard.__new__(Pyboard)
+        board.serial = mock_port(b"")
+        board.read_until = mock.Mock(return_value=b"MPY: soft reboot\r\n")
+        board.soft_reset()
+        # The delay is honoured and main.py is interrupted after the reboot.
+        self.assertEqual(sleep.call_args_list[0], mock.call(2))
+        self.assertEqual(
+            board.serial.write.call_args_list,
+            [
+                mock.call(b"\r\x03\x03"),
+                mock.call(b"\x04"),
+                mock.call(b"\x03"),
+                mock.call(b"\x03"),
+            ],
+        )
+        board.serial.read.assert_not_called()
+
+    @mock.patch("ampy.pyboard.time.sleep")
+    @mock.patch("ampy.pyboard._rawdelay", 0)
+    def test_soft_reset_failed(self, sleep):
+        board = Pyboard.__new__(Pyboard)
+        board.serial = mock_port(b"")
+        board.read_until = mock.Mock(return_value=b"")
+        with self.assertRaises(pyboard.PyboardError):
+            board.soft_reset()
+
+
+if __name__ == "__main__":
+    unittest.main()